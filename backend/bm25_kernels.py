@@ -0,0 +1,70 @@
+"""Numba kernels for BM25 keyword search over a bm25s eager score matrix."""
+from numba import njit
+import numpy as np
+
+@njit(cache=True, nogil=True)
+def max_score_per_term(data, indptr):
+    """Upper bound of each term's contribution to any single document's score."""
+    max_scores = np.zeros(len(indptr) - 1, dtype=np.float32)
+    for t in range(len(indptr) - 1):
+        for j in range(indptr[t], indptr[t + 1]):
+            if data[j] > max_scores[t]:
+                max_scores[t] = data[j]
+    return max_scores
+
+@njit(cache=True, nogil=True)
+def _kth_largest(values, k):
+    return np.partition(values, len(values) - k)[len(values) - k]
+
+@njit(cache=True, nogil=True)
+def bm25_maxscore(query_token_ids, data, indices, indptr, max_scores, num_docs, k):
+    """
+    Scores a query with MaxScore pruning and returns the candidate documents
+    (a superset of the top k) with their exact scores.
+
+    Terms are processed in decreasing order of their max score. Once the max
+    scores of the remaining terms add up to less than the current k-th best
+    score, no unseen document can make the top k, so the remaining posting
+    lists are only probed for the surviving candidates instead of scanned.
+    """
+    terms = query_token_ids[np.argsort(-max_scores[query_token_ids])]
+    # remaining_after[i] is the most the terms after the i-th can still add
+    remaining_after = np.zeros(len(terms), dtype=np.float32)
+    for i in range(len(terms) - 2, -1, -1):
+        remaining_after[i] = remaining_after[i + 1] + max_scores[terms[i + 1]]
+
+    # Essential terms: scan the full posting lists
+    scores = np.zeros(num_docs, dtype=np.float32)
+    threshold = 0.0
+    n_essential = len(terms)
+    for i in range(len(terms)):
+        t = terms[i]
+        for j in range(indptr[t], indptr[t + 1]):
+            scores[indices[j]] += data[j]
+        n_essential = i + 1
+        threshold = _kth_largest(scores, k)
+        if remaining_after[i] < threshold:
+            break
+    remaining = remaining_after[n_essential - 1]
+
+    candidates = np.nonzero((scores > 0) & (scores + remaining >= threshold))[0]
+    candidate_scores = scores[candidates]
+
+    # Non-essential terms: binary search each candidate in the posting list,
+    # dropping candidates as soon as they can no longer reach the top k
+    for i in range(n_essential, len(terms)):
+        t = terms[i]
+        postings = indices[indptr[t]:indptr[t + 1]]
+        positions = np.searchsorted(postings, candidates)
+        for c in range(len(candidates)):
+            pos = positions[c]
+            if pos < len(postings) and postings[pos] == candidates[c]:
+                candidate_scores[c] += data[indptr[t] + pos]
+        remaining = remaining_after[i]
+        if len(candidates) > k:
+            threshold = _kth_largest(candidate_scores, k)
+            keep = candidate_scores + remaining >= threshold
+            candidates = candidates[keep]
+            candidate_scores = candidate_scores[keep]
+
+    return candidates, candidate_scores
@@ -0,0 +1,35 @@
+"""Reciprocal Rank Fusion of the vector and keyword search rankings."""
+import numpy as np
+
+BM25_WEIGHT = 0.5  # Keyword hits count half as much as vector hits of the same rank
+
+def reciprocal_rank_fusion(vector_ids, bm25_rows, id_to_idx, num_docs, top_k):
+    """
+    Fuses Qdrant point ids and BM25 row indices, each best first, and returns
+    the row indices of the top k documents.
+
+    Point ids are mapped to rows through id_to_idx. Points missing from it
+    (e.g. a stale collection) are skipped, and the rest keep their Qdrant rank.
+    Ties are broken in favour of the vector ranking.
+    """
+    # A simple RRF implementation, scored straight into one slot per row
+    scores = np.zeros(num_docs, dtype=np.float32)
+
+    vector_ranks = [
+        (i, id_to_idx[point_id]) for i, point_id in enumerate(vector_ids)
+        if point_id in id_to_idx
+    ]
+    vector_indices = [idx for _, idx in vector_ranks]
+    for i, idx in vector_ranks:
+        scores[idx] += 1 / (i + 1)  # Rank-based score
+
+    scores[bm25_rows] += BM25_WEIGHT / np.arange(1, len(bm25_rows) + 1)
+
+    # Only rows returned by either search can score, so select the top_k among
+    # those (at most 2 * top_k) rather than across the whole dataset. They are
+    # listed vector hits first and sorted stably, so ties keep vector-first order.
+    candidates = np.array(
+        list(dict.fromkeys(vector_indices + bm25_rows.tolist())), dtype=np.int64
+    )
+    top_n = np.argsort(-scores[candidates], kind="stable")[:top_k]
+    return candidates[top_n]
@@ -0,0 +1,53 @@
+"""On-device embeddings with an ONNX export of bge-small-en-v1.5.
+
+Shared by the backend and scripts/ingest.py so queries and documents are
+embedded identically. Needs the optional onnxruntime and tokenizers packages
+(see requirements-local-embed.txt).
+"""
+from pathlib import Path
+
+import numpy as np
+
+EMBEDDING_SIZE = 384  # bge-small-en-v1.5 embeds to 384 dimensions
+QUERY_PREFIX = "Represent this sentence for searching relevant passages: "
+
+
+class LocalEmbedder:
+    """Loads model.onnx and tokenizer.json from a directory and embeds batches of texts.
+
+    intra_op_num_threads=0 lets onnxruntime use every core. Callers that run
+    several embeds at once should split the cores between them instead.
+    """
+
+    def __init__(self, model_dir, intra_op_num_threads=0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = intra_op_num_threads
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            str(Path(model_dir) / "model.onnx"),
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+        self.tokenizer.enable_padding()
+        self.tokenizer.enable_truncation(max_length=512)
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Embeds texts, using the normalized CLS token like BGE."""
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        hidden_states = self.session.run(
+            None, {k: v for k, v in inputs.items() if k in self.input_names}
+        )[0]
+        embeddings = hidden_states[:, 0]
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
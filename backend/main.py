@@ -1,15 +1,30 @@
 
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field
 import cohere
 import qdrant_client
 from qdrant_client.http import models
-from rank_bm25 import BM25Okapi
+import bm25s
+import Stemmer
+import numpy as np
 import pandas as pd
 import os
+import asyncio
+import threading
+from collections import OrderedDict
+import sys
+import hashlib
 from dotenv import load_dotenv
 from pathlib import Path
 
+# Sibling modules resolve whether the app is started as backend.main from the
+# repo root or as main from inside backend/ (as in the Docker image)
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from bm25_kernels import bm25_maxscore, max_score_per_term
+from fusion import reciprocal_rank_fusion
+from local_embedder import LocalEmbedder, QUERY_PREFIX
+
 # Configuration
 load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
@@ -17,43 +32,253 @@ QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 COLLECTION_NAME = "founders"
 
+# Optional on-device embeddings. Point this at a directory holding an ONNX
+# export of bge-small-en-v1.5 (model.onnx, ideally int8-quantized) and its
+# tokenizer.json to embed queries locally instead of calling Cohere. The
+# collection must have been ingested with the same model.
+LOCAL_EMBED_MODEL_DIR = os.getenv("LOCAL_EMBED_MODEL_DIR")
+
+# The collection stores int8-quantized vectors (see scripts/ingest.py). Search
+# the int8 copy with a 2x shortlist, then rescore it with the original vectors.
+SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
 # --- Data and Model Loading --- 
 
 # Initialize clients
-co = cohere.Client(COHERE_API_KEY)
-qdrant_client = qdrant_client.QdrantClient(
+if LOCAL_EMBED_MODEL_DIR:
+    local_embedder = LocalEmbedder(LOCAL_EMBED_MODEL_DIR, intra_op_num_threads=2)
+else:
+    co = cohere.AsyncClient(COHERE_API_KEY)
+qdrant_client = qdrant_client.AsyncQdrantClient(
     url=QDRANT_URL, 
     api_key=QDRANT_API_KEY,
+    prefer_grpc=True,  # Protobuf vectors over a multiplexed HTTP/2 connection
+    grpc_port=6334,
     timeout=30.0
 )
 
 # Load data for BM25
 SCRIPT_DIR = Path(__file__).resolve().parent.parent
 CSV_PATH = SCRIPT_DIR / "data" / "founders.csv"
+BM25_INDEX_PATH = SCRIPT_DIR / "data" / "bm25_index"
+BM25_CSV_HASH_FILENAME = "csv.sha256"  # Written by scripts/ingest.py
 df = pd.read_csv(CSV_PATH)
 df = df.fillna('')
-df['chunk'] = df.apply(
-    lambda row: f"{row.get('founder_name', '')}, {row.get('role', '')} at {row.get('company', '')}, {row.get('location', '')}. Idea: {row.get('idea', '')}. Bio: {row.get('about', '')}. Keywords: {row.get('keywords', '')}.",
-    axis=1
+df['chunk'] = (
+    df['founder_name'].astype(str) + ', ' + df['role'].astype(str)
+    + ' at ' + df['company'].astype(str) + ', ' + df['location'].astype(str)
+    + '. Idea: ' + df['idea'].astype(str)
+    + '. Bio: ' + df['about'].astype(str)
+    + '. Keywords: ' + df['keywords'].astype(str) + '.'
 )
 
-# Create BM25 index from the documents
-tokenized_corpus = [doc.split(" ") for doc in df['chunk']]
-bm25 = BM25Okapi(tokenized_corpus)
+# Documents and queries must be tokenized the same way (see scripts/ingest.py):
+# lowercased, punctuation and English stopwords dropped, and stemmed.
+stemmer = Stemmer.Stemmer("english")
+stemmer_lock = threading.Lock()  # Stemmer objects aren't thread-safe
+
+# Create BM25 index from the documents. BM25S computes the term scores eagerly
+# and stores them in a sparse matrix, so a query only sums a few columns.
+# Each term's postings are contiguous int32 doc ids alongside float32 scores,
+# which keeps the scoring loop a tight, vectorizable scatter-add.
+# The index saved by scripts/ingest.py is memory-mapped, so all uvicorn workers
+# share one copy of the postings; without it the index is built here.
+def _load_bm25_index():
+    """
+    Loads the saved index if it was built from the current CSV. Its doc ids are
+    row indices into df, so an index from a different CSV would point at the
+    wrong rows (or past the end of them), and is rebuilt instead.
+    """
+    csv_hash = hashlib.sha256(CSV_PATH.read_bytes()).hexdigest()
+    hash_path = BM25_INDEX_PATH / BM25_CSV_HASH_FILENAME
+    if hash_path.exists() and hash_path.read_text().strip() == csv_hash:
+        retriever = bm25s.BM25.load(BM25_INDEX_PATH, mmap=True)
+        if retriever.scores["num_docs"] == len(df):
+            return retriever
+    if BM25_INDEX_PATH.exists():
+        print(f"BM25 index at {BM25_INDEX_PATH} doesn't match {CSV_PATH}; rebuilding it in memory.")
+
+    retriever = bm25s.BM25(dtype="float32", int_dtype="int32")
+    retriever.index(bm25s.tokenize(df['chunk'].tolist(), stopwords="english", stemmer=stemmer))
+    return retriever
+
+retriever = _load_bm25_index()
+
+# Row payloads are built once so search results can be looked up by row index
+payloads = df.to_dict(orient='records')
+id_to_idx = {row_id: i for i, row_id in enumerate(df['id'].tolist())}
+
+bm25_data = retriever.scores["data"]
+bm25_indices = retriever.scores["indices"]
+bm25_indptr = retriever.scores["indptr"]
+bm25_max_scores = max_score_per_term(bm25_data, bm25_indptr)
+
+# Warm up the JIT once so the first request doesn't pay the compilation cost
+bm25_maxscore(
+    np.zeros(1, dtype=np.int32), bm25_data, bm25_indices, bm25_indptr,
+    bm25_max_scores, len(df), 1
+)
+
+# Queries from concurrent requests are coalesced into a single Cohere call. The
+# batcher waits a few milliseconds for more queries to arrive before sending.
+# Local embeds take about as long as that wait, so by default they only batch
+# queries that are already queued.
+EMBED_BATCH_SIZE = 96  # Cohere accepts at most 96 texts per embed call
+EMBED_BATCH_WINDOW = float(os.getenv(
+    "EMBED_BATCH_WINDOW", "0" if LOCAL_EMBED_MODEL_DIR else "0.01"
+))  # Seconds to wait for a batch to fill up
+MAX_EMBED_CHARS = 2048  # Cohere's per-text character limit
+embed_queue = None  # Created on startup, once the event loop is running
+
+embed_batch_tasks = set()  # Holds a reference to each in-flight embed call
+
+async def _embed_batch(batch):
+    """Embeds one batch of queued queries and resolves their futures."""
+    texts = [text for text, _ in batch]
+    try:
+        if LOCAL_EMBED_MODEL_DIR:
+            embeddings = await asyncio.to_thread(
+                local_embedder.embed, [QUERY_PREFIX + text for text in texts]
+            )
+        else:
+            response = await co.embed(
+                texts=texts,
+                model="embed-english-v3.0",
+                input_type="search_query"
+            )
+            embeddings = response.embeddings
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    for (_, future), embedding in zip(batch, embeddings):
+        if not future.done():
+            future.set_result(tuple(embedding))
+    # A short response would otherwise leave the remaining requests waiting forever
+    for _, future in batch[len(embeddings):]:
+        if not future.done():
+            future.set_exception(RuntimeError(
+                f"Embedding call returned {len(embeddings)} embeddings for {len(batch)} queries"
+            ))
+
+async def _embed_batcher():
+    """
+    Drains the embed queue into batches of up to EMBED_BATCH_SIZE queries. Each
+    batch is embedded in its own task, so a slow call doesn't hold up the next.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await embed_queue.get()]
+        deadline = loop.time() + EMBED_BATCH_WINDOW
+        while len(batch) < EMBED_BATCH_SIZE:
+            if not embed_queue.empty():
+                batch.append(embed_queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(embed_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        task = asyncio.create_task(_embed_batch(batch))
+        embed_batch_tasks.add(task)
+        task.add_done_callback(embed_batch_tasks.discard)
+
+# Embeddings are deterministic per input, so repeated queries are served from
+# memory instead of paying for another Cohere round-trip.
+EMBEDDING_CACHE_SIZE = 4096
+embedding_cache = OrderedDict()
+embedding_cache_stats = {"hits": 0, "misses": 0}
+
+async def _embed_query(query: str) -> tuple[float, ...]:
+    """Embed a search query, serving repeats from an LRU cache."""
+    if query in embedding_cache:
+        embedding_cache.move_to_end(query)
+        embedding_cache_stats["hits"] += 1
+        return embedding_cache[query]
+
+    embedding_cache_stats["misses"] += 1
+    future = asyncio.get_running_loop().create_future()
+    # Queries are short, so anything past the limit is simply cut off
+    await embed_queue.put((query[:MAX_EMBED_CHARS], future))
+    embedding = await future
+
+    embedding_cache[query] = embedding
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)  # Evict the least recently used query
+    return embedding
+
+def _bm25_search(query: str, top_k: int) -> np.ndarray:
+    """
+    Runs the keyword search and returns the row indices of the top k documents,
+    best first. CPU-bound, so it is called from a worker thread.
+    """
+    with stemmer_lock:
+        query_tokens = bm25s.tokenize(
+            query, stopwords="english", stemmer=stemmer, return_ids=False, show_progress=False
+        )[0]
+    query_token_ids = np.array(retriever.get_tokens_ids(query_tokens), dtype=np.int32)
+
+    if len(query_token_ids) == 0:  # No query token appears in the corpus
+        return np.zeros(0, dtype=np.int64)
+
+    candidates, candidate_scores = bm25_maxscore(
+        query_token_ids, bm25_data, bm25_indices, bm25_indptr,
+        bm25_max_scores, len(df), min(top_k, len(df))
+    )
+
+    # Get top k results for BM25: partition out the k best, then sort only those
+    top_n = np.arange(len(candidates))
+    if len(candidates) > top_k:
+        top_n = np.argpartition(candidate_scores, -top_k)[-top_k:]
+    top_n = top_n[np.argsort(-candidate_scores[top_n])]
+    return candidates[top_n]
+
+def _fuse_results(vector_search_results, bm25_rows: np.ndarray, top_k: int) -> list[dict]:
+    """Combines vector and keyword results with Reciprocal Rank Fusion."""
+    # Point IDs are the CSV ids (see scripts/ingest.py); BM25 results are row indices already
+    rows = reciprocal_rank_fusion(
+        [result.id for result in vector_search_results], bm25_rows, id_to_idx, len(df), top_k
+    )
+    return [payloads[idx] for idx in rows]
 
 # --- FastAPI Application ---
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts the embedding batcher for the lifetime of the app."""
+    global embed_queue
+    embed_queue = asyncio.Queue()
+    batcher_task = asyncio.create_task(_embed_batcher())
+    yield
+    batcher_task.cancel()
+    for task in list(embed_batch_tasks):
+        task.cancel()
+
 app = FastAPI(
     title="Founder RAG Chatbot API",
-    description="API for searching startup founders using hybrid search."
+    description="API for searching startup founders using hybrid search.",
+    lifespan=lifespan
 )
 
 class SearchQuery(BaseModel):
     query: str
-    top_k: int = 5
+    top_k: int = Field(5, gt=0)
+
+MAX_BATCH_QUERIES = EMBED_BATCH_SIZE  # One batch fits in a single embed call
+
+class BatchSearchQuery(BaseModel):
+    queries: list[str]
+    top_k: int = Field(5, gt=0)
 
 @app.post("/search")
-def search(search_query: SearchQuery):
+async def search(search_query: SearchQuery):
     """Performs hybrid search (vector + keyword) over the dataset."""
     query = search_query.query
     top_k = search_query.top_k
@@ -61,66 +286,98 @@ def search(search_query: SearchQuery):
     if not query:
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
+    # The keyword search doesn't depend on the embedding, so it runs in a worker
+    # thread while we wait on Cohere and Qdrant.
+    bm25_task = asyncio.create_task(asyncio.to_thread(_bm25_search, query, top_k))
+
     # 1. Vector Search (Semantic)
     try:
-        query_embedding = co.embed(
-            texts=[query],
-            model="embed-english-v3.0",
-            input_type="search_query"
-        ).embeddings[0]
+        query_embedding = await _embed_query(query)
 
-        vector_search_results = qdrant_client.search(
+        vector_search_results = await qdrant_client.search(
             collection_name=COLLECTION_NAME,
-            query_vector=query_embedding,
+            query_vector=list(query_embedding),
             limit=top_k,
-            with_payload=True
+            search_params=SEARCH_PARAMS,
+            with_payload=False,  # Payloads come from the local table after ranking
+            with_vectors=False
         )
     except Exception as e:
+        bm25_task.cancel()  # Nothing will await the keyword search now
         raise HTTPException(status_code=500, detail=f"Vector search failed: {e}")
 
     # 2. Keyword Search (BM25)
-    tokenized_query = query.split(" ")
-    bm25_scores = bm25.get_scores(tokenized_query)
-    
-    # Get top k results for BM25
-    top_n_indices = bm25_scores.argsort()[-top_k:][::-1]
-    bm25_results = []
-    for idx in top_n_indices:
-        if bm25_scores[idx] > 0:
-            bm25_results.append({
-                "score": bm25_scores[idx],
-                "payload": df.iloc[idx].to_dict()
-            })
+    bm25_rows = await bm25_task
 
     # 3. Hybrid Ranking (Reciprocal Rank Fusion)
-    # A simple RRF implementation
-    ranked_results = {}
-    
-    # Process vector search results
-    for i, result in enumerate(vector_search_results):
-        doc_id = result.payload['id']
-        if doc_id not in ranked_results:
-            ranked_results[doc_id] = {"score": 0, "payload": result.payload}
-        ranked_results[doc_id]["score"] += 1 / (i + 1) # Rank-based score
-
-    # Process BM25 results
-    for i, result in enumerate(bm25_results):
-        doc_id = result["payload"]['id']
-        if doc_id not in ranked_results:
-            ranked_results[doc_id] = {"score": 0, "payload": result["payload"]}
-        ranked_results[doc_id]["score"] += 0.5 / (i + 1) # Lower weight for BM25
-
-    # Sort by the combined score
-    sorted_results = sorted(ranked_results.values(), key=lambda x: x["score"], reverse=True)
-
-    # Limit to top_k and format the output
-    final_results = [item["payload"] for item in sorted_results[:top_k]]
+    final_results = _fuse_results(vector_search_results, bm25_rows, top_k)
 
     if not final_results:
         return {"message": "No relevant results found."}
 
     return {"results": final_results}
 
+@app.post("/search_batch")
+async def search_batch(batch_query: BatchSearchQuery):
+    """Performs hybrid search for several queries in one round-trip."""
+    queries = batch_query.queries
+    top_k = batch_query.top_k
+
+    if not queries or not all(queries):
+        raise HTTPException(status_code=400, detail="Queries cannot be empty.")
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_QUERIES} queries can be searched at once."
+        )
+
+    # Repeated queries are searched once and fanned back out at the end
+    unique_queries = list(dict.fromkeys(queries))
+
+    bm25_task = asyncio.create_task(asyncio.to_thread(
+        lambda: [_bm25_search(query, top_k) for query in unique_queries]
+    ))
+
+    # 1. Vector Search (Semantic)
+    try:
+        # The embed batcher packs these into a single Cohere call
+        query_embeddings = await asyncio.gather(*[_embed_query(query) for query in unique_queries])
+
+        vector_search_results = await qdrant_client.search_batch(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                models.SearchRequest(
+                    vector=list(embedding), limit=top_k, params=SEARCH_PARAMS, with_payload=False
+                )
+                for embedding in query_embeddings
+            ]
+        )
+    except Exception as e:
+        bm25_task.cancel()  # Nothing will await the keyword search now
+        raise HTTPException(status_code=500, detail=f"Vector search failed: {e}")
+
+    # 2. Keyword Search (BM25)
+    bm25_rows = await bm25_task
+
+    # 3. Hybrid Ranking (Reciprocal Rank Fusion)
+    results_by_query = {
+        query: _fuse_results(vector_results, keyword_rows, top_k)
+        for query, vector_results, keyword_rows
+        in zip(unique_queries, vector_search_results, bm25_rows)
+    }
+    return {"results": [results_by_query[query] for query in queries]}
+
+@app.get("/stats")
+def stats():
+    """Reports hit/miss counters for the query embedding cache."""
+    return {
+        "embedding_cache": {
+            **embedding_cache_stats,
+            "maxsize": EMBEDDING_CACHE_SIZE,
+            "currsize": len(embedding_cache)
+        }
+    }
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Founder RAG Chatbot API. Use the /docs endpoint to see the API documentation."}
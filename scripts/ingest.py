@@ -1,13 +1,15 @@
 
 import pandas as pd
 import qdrant_client
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
 import cohere
-from rank_bm25 import BM25Okapi
-import numpy as np
-import json
+import bm25s
+import Stemmer
 import os
-import uuid
+import hashlib
+import asyncio
+import sys
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -22,25 +24,63 @@ QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 SCRIPT_DIR = Path(__file__).resolve().parent.parent
 CSV_PATH = SCRIPT_DIR / "data" / "founders.csv"
 COLLECTION_NAME = "founders"
-BM25_INDEX_PATH = SCRIPT_DIR / "data" / "bm25_index.json"
+BM25_INDEX_PATH = SCRIPT_DIR / "data" / "bm25_index"
+BM25_CSV_HASH_FILENAME = "csv.sha256"  # Lets the backend detect a stale index
 
+# The local embedder lives in backend/ so queries and documents share one implementation
+sys.path.insert(0, str(SCRIPT_DIR / "backend"))
+from local_embedder import EMBEDDING_SIZE as LOCAL_EMBEDDING_SIZE, LocalEmbedder
+
+# Optional on-device embeddings, see backend/main.py. The backend must be run
+# with the same model directory.
+LOCAL_EMBED_MODEL_DIR = os.getenv("LOCAL_EMBED_MODEL_DIR")
+# Cohere's embed-english-v3.0 embeds to 1024 dimensions
+EMBEDDING_SIZE = LOCAL_EMBEDDING_SIZE if LOCAL_EMBED_MODEL_DIR else 1024
 
 # Initialize clients
-co = cohere.Client(COHERE_API_KEY)
 qdrant_client = qdrant_client.QdrantClient(
     url=QDRANT_URL,
     api_key=QDRANT_API_KEY,
     timeout=60.0  # Set a longer timeout to 60 seconds
 )
 
+MAX_IN_FLIGHT_BATCHES = 4
+
+# Async clients let embedding and upserting of different batches overlap
+if LOCAL_EMBED_MODEL_DIR:
+    # Up to MAX_IN_FLIGHT_BATCHES embed calls run at once, so they split the
+    # cores between them rather than each starting a thread per core
+    local_embedder = LocalEmbedder(
+        LOCAL_EMBED_MODEL_DIR,
+        intra_op_num_threads=max(1, (os.cpu_count() or 1) // MAX_IN_FLIGHT_BATCHES)
+    )
+else:
+    async_co = cohere.AsyncClient(COHERE_API_KEY)
+async_qdrant_client = AsyncQdrantClient(
+    url=QDRANT_URL,
+    api_key=QDRANT_API_KEY,
+    timeout=60.0
+)
+FLUSH_TIMEOUT = 120.0  # Seconds to wait for queued upserts to be applied
+MAX_EMBED_CHARS = 2048  # Cohere's per-text character limit
+
 def create_qdrant_collection():
     """Create the Qdrant collection if it doesn't exist."""
     try:
         qdrant_client.recreate_collection(
             collection_name=COLLECTION_NAME,
             vectors_config=models.VectorParams(
-                size=1024,  # Cohere's default embedding size for embed-english-v3.0
+                size=EMBEDDING_SIZE,
                 distance=models.Distance.COSINE
+            ),
+            # Keep an int8 copy of the vectors in RAM for search; a quarter of
+            # the size of float32. The originals are kept for rescoring.
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
             )
         )
         print(f"Collection '{COLLECTION_NAME}' created.")
@@ -56,19 +96,21 @@ def load_and_prepare_data():
         
     df = pd.read_csv(CSV_PATH)
 
-    # Preserve the original ID from the CSV by renaming it to 'row_id'.
+    # Preserve the original ID from the CSV by renaming it to 'row_id'. It is
+    # also the Qdrant point ID, so the backend can map search hits back to
+    # its own rows without fetching payloads.
     if 'id' in df.columns:
         df.rename(columns={'id': 'row_id'}, inplace=True)
-
-    # Always generate a new 'uuid' for each row to use as the Qdrant point ID.
-    df['uuid'] = [str(uuid.uuid4()) for _ in range(len(df))]
         
     df = df.fillna('')
 
     # Concatenate fields for a rich text chunk
-    df['chunk'] = df.apply(
-        lambda row: f"{row.get('founder_name', '')}, {row.get('role', '')} at {row.get('company', '')}, {row.get('location', '')}. Idea: {row.get('idea', '')}. Bio: {row.get('about', '')}. Keywords: {row.get('keywords', '')}.",
-        axis=1
+    df['chunk'] = (
+        df['founder_name'].astype(str) + ', ' + df['role'].astype(str)
+        + ' at ' + df['company'].astype(str) + ', ' + df['location'].astype(str)
+        + '. Idea: ' + df['idea'].astype(str)
+        + '. Bio: ' + df['about'].astype(str)
+        + '. Keywords: ' + df['keywords'].astype(str) + '.'
     )
     return df
 
@@ -76,64 +118,96 @@ def create_and_save_bm25_index(df):
     """Create and save the BM25 index."""
     if df is None:
         return
-    tokenized_corpus = [doc.split(" ") for doc in df['chunk']]
-    bm25 = BM25Okapi(tokenized_corpus)
+    retriever = bm25s.BM25(dtype="float32", int_dtype="int32")
+    # Must match the tokenization the backend applies to queries
+    stemmer = Stemmer.Stemmer("english")
+    retriever.index(bm25s.tokenize(df['chunk'].tolist(), stopwords="english", stemmer=stemmer))
     
-    print("BM25 index created. It will be recreated on app startup.")
-    # In a production scenario, you would pickle and save the bm25 object
-    # with open(BM25_INDEX_PATH, 'wb') as f:
-    #     pickle.dump(bm25, f)
-
-def embed_and_upsert(df):
-    """Embed data using Cohere and upsert to Qdrant."""
+    # Saved as .npy arrays so every API worker can memory-map the same copy
+    retriever.save(BM25_INDEX_PATH)
+    csv_hash = hashlib.sha256(CSV_PATH.read_bytes()).hexdigest()
+    (BM25_INDEX_PATH / BM25_CSV_HASH_FILENAME).write_text(csv_hash)
+    print(f"BM25 index saved to {BM25_INDEX_PATH}.")
+
+async def embed_and_upsert(df):
+    """Embed data and upsert to Qdrant, keeping several batches in flight."""
     if df is None:
         return
         
-    batch_size = 32  # Reduced batch size for stability
+    batch_size = 96  # Cohere's limit of texts per embed call
     total_rows = len(df)
+    total_batches = (total_rows + batch_size - 1) // batch_size
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT_BATCHES)
+
+    # Convert every row to a JSON serializable payload once, up front. to_dict
+    # returns plain Python numbers; missing values are already '' (see
+    # load_and_prepare_data), matching the payloads the backend builds.
+    payloads = df.to_dict(orient='records')
 
-    for i in range(0, total_rows, batch_size):
+    async def process(i):
         batch_df = df.iloc[i:i + batch_size]
-        texts = batch_df['chunk'].tolist()
+        # The limit applies per text, not to the batch, so only oversize chunks
+        # need handling. Each point gets one vector, so they are cut off.
+        texts = [text[:MAX_EMBED_CHARS] for text in batch_df['chunk'].tolist()]
         
-        print(f"Embedding batch {i//batch_size + 1}/{(total_rows + batch_size - 1)//batch_size}...")
-        response = co.embed(
-            texts=texts,
-            model="embed-english-v3.0",
-            input_type="search_document"
-        )
-        embeddings = response.embeddings
-
-        # Prepare points for Qdrant
-        points = []
-        for idx, row in batch_df.iterrows():
-            # Get the corresponding embedding
-            embedding_index = idx - i
-            embedding = embeddings[embedding_index]
-            
-            payload = row.to_dict()
-            # Ensure payload values are JSON serializable
-            for key, value in payload.items():
-                if isinstance(value, (np.int64, np.float64)):
-                    payload[key] = str(value) # or int(value), float(value)
-                elif pd.isna(value):
-                    payload[key] = None
-
-            points.append(
+        async with semaphore:
+            print(f"Embedding batch {i//batch_size + 1}/{total_batches}...")
+            if LOCAL_EMBED_MODEL_DIR:
+                embeddings = await asyncio.to_thread(local_embedder.embed, texts)
+            else:
+                response = await async_co.embed(
+                    texts=texts,
+                    model="embed-english-v3.0",
+                    input_type="search_document"
+                )
+                embeddings = response.embeddings
+
+            # Prepare points for Qdrant
+            points = [
                 models.PointStruct(
-                    id=row['uuid'], # Use the new 'uuid' column for the point ID
+                    id=int(payload['row_id']), # Use the CSV id as the point ID
                     vector=embedding,
                     payload=payload
                 )
+                for payload, embedding in zip(payloads[i:i + batch_size], embeddings)
+            ]
+            
+            # Queue the upsert in Qdrant without waiting for it to be applied
+            await async_qdrant_client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=points,
+                wait=False
             )
-        
-        # Upsert points to Qdrant
-        qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points,
-            wait=True
+            print(f"Queued {len(points)} points for upsert to Qdrant.")
+            return points
+
+    batches = await asyncio.gather(*[process(i) for i in range(0, total_rows, batch_size)])
+
+    # Qdrant applies updates in order, so re-sending the last batch with
+    # wait=True returns only once every queued upsert before it is applied
+    try:
+        await asyncio.wait_for(
+            async_qdrant_client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=batches[-1],
+                wait=True
+            ),
+            timeout=FLUSH_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise RuntimeError(
+            f"Qdrant did not apply the queued upserts within {FLUSH_TIMEOUT:.0f} seconds."
+        )
+
+    # Duplicate CSV ids collapse into one point, and a collection that wasn't
+    # recreated may still hold stale points; both leave the count off
+    expected = len({point.id for points in batches for point in points})
+    count = (await async_qdrant_client.count(COLLECTION_NAME, exact=True)).count
+    if count != expected:
+        raise RuntimeError(
+            f"Expected {expected} points in '{COLLECTION_NAME}' but found {count}."
         )
-        print(f"Upserted {len(points)} points to Qdrant.")
+    print(f"Upserted {count} points to Qdrant.")
 
 def main():
     """Main function to run the ingestion process."""
@@ -141,7 +215,7 @@ def main():
     create_qdrant_collection()
     df = load_and_prepare_data()
     create_and_save_bm25_index(df)
-    embed_and_upsert(df)
+    asyncio.run(embed_and_upsert(df))
     print("Data ingestion complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import random
+from pathlib import Path
+
+import bm25s
+import numpy as np
+import pandas as pd
+import pytest
+import Stemmer
+
+from bm25_kernels import bm25_maxscore, max_score_per_term
+
+CSV_PATH = Path(__file__).resolve().parent.parent / "data" / "founders.csv"
+
+
+@pytest.fixture(scope="module")
+def built_retriever():
+    df = pd.read_csv(CSV_PATH).fillna('')
+    corpus = (df['idea'] + ' ' + df['about'] + ' ' + df['keywords']).tolist()
+    retriever = bm25s.BM25(dtype="float32", int_dtype="int32")
+    retriever.index(
+        bm25s.tokenize(corpus, stopwords="english", stemmer=Stemmer.Stemmer("english"),
+                       show_progress=False),
+        show_progress=False
+    )
+    return retriever
+
+
+@pytest.fixture(scope="module", params=["built", "mmap"])
+def retriever(request, built_retriever, tmp_path_factory):
+    if request.param == "built":
+        return built_retriever
+    index_dir = tmp_path_factory.mktemp("bm25_index")
+    built_retriever.save(index_dir)
+    return bm25s.BM25.load(index_dir, mmap=True)
+
+
+def test_maxscore_matches_exhaustive_ranking(retriever):
+    data, indices, indptr = (retriever.scores[key] for key in ("data", "indices", "indptr"))
+    num_docs = retriever.scores["num_docs"]
+    max_scores = max_score_per_term(data, indptr)
+    vocab = [token for token in retriever.vocab_dict if token]
+
+    rng = random.Random(0)
+    for _ in range(500):
+        # Sampling with replacement repeats tokens, which must count once per occurrence
+        query = rng.choices(vocab, k=rng.randint(1, 6))
+        k = rng.randint(1, 40)  # Often more than the number of matching documents
+        query_token_ids = np.array(retriever.get_tokens_ids(query), dtype=np.int32)
+
+        candidates, candidate_scores = bm25_maxscore(
+            query_token_ids, data, indices, indptr, max_scores, num_docs, k
+        )
+        got = np.sort(candidate_scores)[::-1][:k]
+
+        expected_scores = retriever.get_scores(query)
+        expected = np.sort(expected_scores[expected_scores > 0])[::-1][:k]
+
+        assert np.allclose(got, expected, atol=1e-5)
+        assert np.allclose(candidate_scores, expected_scores[candidates], atol=1e-5)
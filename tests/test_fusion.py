@@ -0,0 +1,17 @@
+import numpy as np
+
+from fusion import reciprocal_rank_fusion
+
+ID_TO_IDX = {"a": 0, "b": 1, "c": 2, "d": 3}
+
+
+def test_vector_hit_wins_tie_with_bm25_hit():
+    # Vector rank 2 ("b", row 1) scores 1/2, the same as BM25 rank 1 (row 2) at 0.5/1
+    rows = reciprocal_rank_fusion(["a", "b"], np.array([2, 3]), ID_TO_IDX, 4, 4)
+    assert rows.tolist() == [0, 1, 2, 3]
+
+
+def test_unknown_point_id_is_skipped():
+    # "zz" isn't in the CSV; "b" keeps its Qdrant rank 2 rather than moving up
+    rows = reciprocal_rank_fusion(["a", "zz", "b"], np.array([3]), ID_TO_IDX, 4, 4)
+    assert rows.tolist() == [0, 3, 1]